@@ -1,6 +1,12 @@
-from flask import Flask, render_template, request, send_from_directory
+from flask import Flask, render_template, request, send_from_directory, jsonify, url_for, make_response
 import os
-from nba_card_generator import NBAStatsCard
+import time
+import glob
+import hashlib
+from io import BytesIO
+from celery import Celery
+from celery.result import AsyncResult
+from nba_card_generator import NBAStatsCard, PNG_SAVE_OPTIONS
 from requests.exceptions import Timeout
 import logging
 
@@ -16,36 +22,140 @@ if not os.path.exists(cards_dir):
     os.makedirs(cards_dir)
 app.config['UPLOAD_FOLDER'] = cards_dir
 
+# When running behind Nginx/Apache, let the front-end server stream card files itself
+app.config['X_ACCEL_REDIRECT_PREFIX'] = os.environ.get('X_ACCEL_REDIRECT_PREFIX')
+app.config['USE_X_SENDFILE'] = os.environ.get('USE_X_SENDFILE', '').lower() in ('1', 'true', 'yes')
+
+# Serve card images from a CDN in front of /cards/ when configured
+app.config['CDN_DOMAIN'] = os.environ.get('CDN_DOMAIN')
+
+# Generated cards are reused for a day; their filenames carry a content hash,
+# so browsers and the CDN can cache each file forever
+CARD_MAX_AGE = 86400
+CARD_CACHE_CONTROL_MAX_AGE = 31536000
+
+def card_prefix(player_name):
+    """Get the filename prefix shared by every version of a player's card."""
+    return f"{player_name.replace(' ', '_').lower()}_stats_card_"
+
+def find_cached_card(player_name):
+    """Return the filename of a player's card if it was generated within CARD_MAX_AGE."""
+    pattern = os.path.join(app.config['UPLOAD_FOLDER'], glob.escape(card_prefix(player_name)) + '*.png')
+    filepaths = glob.glob(pattern)
+    if not filepaths:
+        return None
+    filepath = max(filepaths, key=os.path.getmtime)
+    if time.time() - os.path.getmtime(filepath) < CARD_MAX_AGE:
+        return os.path.basename(filepath)
+    return None
+
+def save_card(card, player_name):
+    """Save a card under a content-hashed filename, removing versions older than CARD_MAX_AGE."""
+    buffer = BytesIO()
+    card.save(buffer, **PNG_SAVE_OPTIONS)
+    png_bytes = buffer.getvalue()
+    prefix = card_prefix(player_name)
+    filename = f"{prefix}{hashlib.sha1(png_bytes).hexdigest()[:8]}.png"
+    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    with open(filepath, 'wb') as f:
+        f.write(png_bytes)
+
+    # Recent versions stay, since pages (or a concurrent render) may still reference them
+    for old_filepath in glob.glob(os.path.join(app.config['UPLOAD_FOLDER'], glob.escape(prefix) + '*.png')):
+        try:
+            if old_filepath != filepath and time.time() - os.path.getmtime(old_filepath) >= CARD_MAX_AGE:
+                os.remove(old_filepath)
+        except OSError:
+            pass  # Another worker may have removed it already
+    return filename
+
+def card_url(filename):
+    """Get the public URL for a card, pointing at the CDN when one is configured."""
+    path = url_for('serve_card', filename=filename)
+    if app.config['CDN_DOMAIN']:
+        return f"https://{app.config['CDN_DOMAIN']}{path}"
+    return path
+
+app.jinja_env.globals['card_url'] = card_url
+
+# Card generation runs on a Celery worker so slow NBA API calls don't tie up web workers
+broker_url = os.environ.get('CELERY_BROKER_URL', os.environ.get('REDIS_URL', 'redis://localhost:6379/0'))
+celery = Celery('nba', broker=broker_url, backend=os.environ.get('CELERY_RESULT_BACKEND', broker_url))
+
+# NBAStatsCard holds no per-request state, so one instance serves every card
+generator = NBAStatsCard()
+
+@celery.task
+def generate_card_task(player_name):
+    """Generate and save a stats card, returning the filename or a user-facing error."""
+    filename = find_cached_card(player_name)
+    if filename:
+        return {'filename': filename}
+
+    try:
+        card = generator.create_stats_card(player_name)
+        return {'filename': save_card(card, player_name)}
+    except Timeout:
+        logger.error(f'NBA API timeout for player: {player_name}')
+        return {'error': "The NBA API is currently experiencing high latency. Please try again in a few minutes."}
+    except ValueError as e:
+        if "Player not found" in str(e):
+            return {'error': f"Player '{player_name}' not found. Please check the spelling."}
+        return {'error': str(e)}
+    except Exception as e:
+        logger.error(f'Error generating card for {player_name}: {str(e)}')
+        if "timed out" in str(e).lower():
+            return {'error': "The request timed out. Please try again in a few minutes."}
+        return {'error': "An unexpected error occurred. Please try again."}
+
 @app.route('/', methods=['GET', 'POST'])
 def index():
     if request.method == 'POST':
         player_name = request.form['player_name']
-        generator = NBAStatsCard()
-        try:
-            card = generator.create_stats_card(player_name)
-            filename = f"{player_name.replace(' ', '_').lower()}_stats_card.png"
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            card.save(filepath)
-            return render_template('index.html', filename=filename, card_generated=True)
-        except Timeout:
-            error_msg = "The NBA API is currently experiencing high latency. Please try again in a few minutes."
-            logger.error(f'NBA API timeout for player: {player_name}')
-            return render_template('index.html', error=error_msg)
-        except ValueError as e:
-            if "Player not found" in str(e):
-                return render_template('index.html', error=f"Player '{player_name}' not found. Please check the spelling.")
-            return render_template('index.html', error=str(e))
-        except Exception as e:
-            logger.error(f'Error generating card for {player_name}: {str(e)}')
-            if "timed out" in str(e).lower():
-                return render_template('index.html', error="The request timed out. Please try again in a few minutes.")
-            return render_template('index.html', error="An unexpected error occurred. Please try again.")
+        filename = find_cached_card(player_name)
+        if filename:
+            return render_template('index.html', filename=filename)
+        task = generate_card_task.delay(player_name)
+        return render_template('index.html', task_id=task.id, player_name=player_name)
     return render_template('index.html')
 
+@app.route('/status/<task_id>')
+def task_status(task_id):
+    result = AsyncResult(task_id, app=celery)
+    status = {'state': result.state}
+    if result.successful():
+        outcome = result.result
+        if 'filename' in outcome:
+            status['url'] = card_url(outcome['filename'])
+        else:
+            status['error'] = outcome['error']
+    elif result.failed():
+        status['error'] = "An unexpected error occurred. Please try again."
+    return jsonify(status)
+
 @app.route('/cards/<filename>')
 def serve_card(filename):
+    prefix = app.config['X_ACCEL_REDIRECT_PREFIX']
+    if prefix:
+        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        if os.path.basename(filename) != filename or not os.path.isfile(filepath):
+            return make_response('Card not found', 404)
+        response = make_response('')
+        response.headers['X-Accel-Redirect'] = f"{prefix.rstrip('/')}/{filename}"
+        response.headers['Content-Type'] = 'image/png'
+        return response
     return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
 
+@app.after_request
+def add_cache_headers(response):
+    if request.endpoint == 'serve_card' and response.status_code == 200:
+        # send_from_directory marks files no-cache; cards are safe to cache outright
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = CARD_CACHE_CONTROL_MAX_AGE
+        response.cache_control.immutable = True
+    return response
+
 # This is only used when running locally. On production, WSGI is configured differently
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
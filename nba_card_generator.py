@@ -1,19 +1,79 @@
 import time
-import pandas as pd
-import matplotlib.pyplot as plt
+import math
+import random
 import numpy as np
 from PIL import Image, ImageDraw, ImageFont
 import requests
-from io import BytesIO
+from requests.adapters import HTTPAdapter
 from datetime import datetime, timedelta
 from requests.exceptions import Timeout
 import os
 import json
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from ratelimit import limits, RateLimitException
 from nba_api.stats.static import players
-from nba_api.stats.endpoints import commonplayerinfo, playergamelog, leaguedashplayerstats
-from nba_api.stats.library.parameters import SeasonAll
+from nba_api.stats.endpoints import commonplayerinfo, leaguedashplayerstats
+from nba_api.stats.library.http import NBAStatsHTTP
+
+SEASON = '2023-24'
+
+# Fast PNG encoding: cards are mostly flat colors, so zlib level 1 costs little in size
+PNG_SAVE_OPTIONS = {'format': 'PNG', 'compress_level': 1, 'optimize': False}
+
+# League-wide stats snapshot shared by every card in this process
+_LEAGUE_CACHE = {'ts': None, 'data': None, 'by_id': None, 'sorted': None}
+_LEAGUE_LOCK = threading.Lock()
+
+# One pooled session for all stats.nba.com calls, so TCP/TLS connections are reused
+# across endpoints and requests. The adapter doesn't retry; all retries happen in the
+# deadline-bound loop in _fetch_player_stats so they can't outlast its budget.
+_SESSION = requests.Session()
+_SESSION.mount('https://', HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=10,
+    max_retries=0
+))
+NBAStatsHTTP.set_session(_SESSION)
+
+# Player stats fetches in progress, keyed by normalized player name, so concurrent
+# requests for the same player share one upstream fetch
+_INFLIGHT = {}
+_INFLIGHT_LOCK = threading.Lock()
+
+@limits(calls=20, period=60)
+def _count_nba_api_call():
+    """Count one stats.nba.com call against the rate limit."""
+
+def _throttle_nba_api(deadline):
+    """Block until another stats.nba.com call fits within the rate limit.
+
+    Raises Timeout instead of sleeping if the wait would run past the deadline.
+    """
+    while True:
+        try:
+            return _count_nba_api_call()
+        except RateLimitException as e:
+            if time.monotonic() + e.period_remaining > deadline:
+                raise Timeout("NBA API rate limit reached. Please try again later.")
+            time.sleep(e.period_remaining)
+
+def _request_timeout(deadline):
+    """Get the timeout for one NBA API request: at most 10s, and never past the deadline."""
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise Timeout("NBA API timed out after multiple attempts. Please try again later.")
+    return min(remaining, 10)
 
 class NBAStatsCard:
+    # Load fonts once per process (you'll need to provide your own font files)
+    try:
+        _TITLE_FONT = ImageFont.truetype("arial.ttf", 40)
+        _HEADER_FONT = ImageFont.truetype("arial.ttf", 30)
+        _STATS_FONT = ImageFont.truetype("arial.ttf", 24)
+    except OSError:
+        _TITLE_FONT = _HEADER_FONT = _STATS_FONT = ImageFont.load_default()
+
     def __init__(self):
         self.colors = {
             'background': '#1E1E1E',
@@ -32,6 +92,12 @@ class NBAStatsCard:
             'Referer': 'https://stats.nba.com/',
             'Connection': 'keep-alive',
         }
+        # Gradient endpoints as RGB tuples, and a percentile -> hex color lookup table built from them
+        self._gradient_rgb = {
+            name: tuple(int(self.colors[name][i:i + 2], 16) for i in (1, 3, 5))
+            for name in ('gradient_poor', 'gradient_neutral', 'gradient_excellent')
+        }
+        self._gradient = [self._compute_gradient_color(p) for p in range(101)]
         self.cache_dir = 'cache'
         self.cache_duration = timedelta(hours=24)
         
@@ -75,7 +141,144 @@ class NBAStatsCard:
         except:
             pass  # Ignore cache write errors
         
+    def _get_league_cache_path(self):
+        """Get the cache file path for the league stats snapshot."""
+        return os.path.join(self.cache_dir, f"league_{SEASON}.json")
+
+    def _load_league_from_cache(self):
+        """Load the league stats snapshot from disk if available and not expired."""
+        cache_path = self._get_league_cache_path()
+        if not os.path.exists(cache_path):
+            return None
+
+        try:
+            with open(cache_path, 'r') as f:
+                cache_data = json.load(f)
+
+            cache_time = datetime.fromisoformat(cache_data['timestamp'])
+            if datetime.now() - cache_time > self.cache_duration:
+                return None
+
+            return cache_time, cache_data['stats']
+        except:
+            return None
+
+    def _save_league_to_cache(self, cache_time, stats_list):
+        """Save the league stats snapshot to disk."""
+        cache_data = {
+            'timestamp': cache_time.isoformat(),
+            'stats': stats_list
+        }
+
+        try:
+            with open(self._get_league_cache_path(), 'w') as f:
+                json.dump(cache_data, f)
+        except:
+            pass  # Ignore cache write errors
+
+    def _sort_league_columns(self, stats_list):
+        """Compute each advanced stat for the whole league, sorted for percentile lookups."""
+        league = np.array(
+            [(p['PTS'], p['REB'], p['AST'], p['GP'], p['FGA'], p['FTA']) for p in stats_list],
+            dtype=np.float64
+        )
+        pts, reb, ast, gp, fga, fta = league.T
+        league_ts = np.divide(pts, 2 * (fga + 0.44 * fta), out=np.zeros_like(pts), where=fga > 0) * 100
+        return {
+            'PER': np.sort((pts + reb + ast) / gp),
+            'TS%': np.sort(league_ts),
+            'AST/G': np.sort(ast / gp),
+            'REB/G': np.sort(reb / gp)
+        }
+
+    def _league_cache_is_fresh(self):
+        """Check whether the in-memory league snapshot is within cache_duration. Hold _LEAGUE_LOCK."""
+        cache_time = _LEAGUE_CACHE['ts']
+        return cache_time is not None and datetime.now() - cache_time <= self.cache_duration
+
+    def _set_league_cache(self, cache_time, stats_list):
+        """Replace the in-memory league snapshot. Hold _LEAGUE_LOCK."""
+        _LEAGUE_CACHE['ts'] = cache_time
+        _LEAGUE_CACHE['data'] = stats_list
+        _LEAGUE_CACHE['by_id'] = {p['PLAYER_ID']: p for p in stats_list}
+        _LEAGUE_CACHE['sorted'] = self._sort_league_columns(stats_list)
+
+    def get_league_stats(self, deadline=None):
+        """Get league stats for every player, an index by player ID and sorted advanced stat columns.
+
+        The snapshot is kept in memory and on disk for cache_duration, so only
+        the first card per refresh pays for the LeagueDashPlayerStats call.
+        Raises Timeout if a refresh can't finish by the deadline (a time.monotonic() value).
+        """
+        if deadline is None:
+            deadline = time.monotonic() + 30
+
+        with _LEAGUE_LOCK:
+            if not self._league_cache_is_fresh():
+                cached = self._load_league_from_cache()
+                if cached:
+                    print("[DEBUG] Using cached league stats")
+                    self._set_league_cache(*cached)
+            if self._league_cache_is_fresh():
+                return _LEAGUE_CACHE['data'], _LEAGUE_CACHE['by_id'], _LEAGUE_CACHE['sorted']
+
+        # Wait on the rate limit before taking the lock, so a throttled refresh doesn't block other cards
+        _throttle_nba_api(deadline)
+        if not _LEAGUE_LOCK.acquire(timeout=max(deadline - time.monotonic(), 0)):
+            raise Timeout("NBA API timed out after multiple attempts. Please try again later.")
+        try:
+            # Another thread may have refreshed the snapshot while this one waited
+            if not self._league_cache_is_fresh():
+                stats_list = leaguedashplayerstats.LeagueDashPlayerStats(
+                    season=SEASON,
+                    headers=self.headers,
+                    timeout=_request_timeout(deadline),
+                    per_mode_detailed='PerGame'
+                ).get_normalized_dict()['LeagueDashPlayerStats']
+                cache_time = datetime.now()
+                self._save_league_to_cache(cache_time, stats_list)
+                self._set_league_cache(cache_time, stats_list)
+
+            return _LEAGUE_CACHE['data'], _LEAGUE_CACHE['by_id'], _LEAGUE_CACHE['sorted']
+        finally:
+            _LEAGUE_LOCK.release()
+
+    def _fetch_player_info(self, player_id, deadline):
+        """Get a player's bio details from the NBA.com API."""
+        _throttle_nba_api(deadline)
+        return commonplayerinfo.CommonPlayerInfo(
+            player_id=player_id,
+            timeout=_request_timeout(deadline),
+            headers=self.headers
+        ).get_normalized_dict()
+
     def get_player_stats(self, player_name):
+        """Get player stats, sharing one fetch between concurrent requests for the same player."""
+        key = player_name.strip().lower()
+        with _INFLIGHT_LOCK:
+            future = _INFLIGHT.get(key)
+            is_owner = future is None
+            if is_owner:
+                future = Future()
+                _INFLIGHT[key] = future
+
+        if not is_owner:
+            print(f"[DEBUG] Waiting on in-flight stats lookup for {player_name}")
+            return future.result()
+
+        try:
+            result = self._fetch_player_stats(player_name)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            # Waiters must be released even if the owner is interrupted (e.g. gevent.Timeout)
+            future.set_exception(e)
+            raise
+        finally:
+            with _INFLIGHT_LOCK:
+                del _INFLIGHT[key]
+
+    def _fetch_player_stats(self, player_name):
         """Get player stats from NBA.com API with retry logic and caching"""
         print(f"[DEBUG] Starting NBA stats lookup for {player_name}")
         
@@ -83,56 +286,41 @@ class NBAStatsCard:
         cached_stats = self._load_from_cache(player_name)
         if cached_stats:
             print("[DEBUG] Using cached stats")
-            return cached_stats, []  # Return empty list for league stats since we don't cache those
-            
+        else:
+            # Find player ID (local lookup, no network)
+            player_dict = players.find_players_by_full_name(player_name)
+            if not player_dict:
+                raise ValueError(f"Player {player_name} not found")
+
+            player_id = player_dict[0]['id']
+            print(f"[DEBUG] Found player ID: {player_id}")
+
         max_retries = 3
         base_delay = 2
+        # Overall budget for all attempts, so a slow API fails fast instead of outliving the worker
+        deadline = time.monotonic() + 25
         
         for attempt in range(max_retries):
+            if deadline - time.monotonic() <= 0:
+                raise Timeout("NBA API timed out after multiple attempts. Please try again later.")
+
             try:
-                # Find player ID
-                player_dict = players.find_players_by_full_name(player_name)
-                if not player_dict:
-                    raise ValueError(f"Player {player_name} not found")
-                
-                player_id = player_dict[0]['id']
-                print(f"[DEBUG] Found player ID: {player_id}")
-                
-                # Get player info with increased timeout and retry
-                try:
-                    player_info = commonplayerinfo.CommonPlayerInfo(
-                        player_id=player_id,
-                        timeout=30,  # Reduced timeout to prevent Gunicorn worker timeout
-                        headers=self.headers
-                    ).get_normalized_dict()
-                except Timeout:
-                    print(f"[DEBUG] Player info request timed out. Attempt {attempt + 1}/{max_retries}")
-                    if attempt == max_retries - 1:
-                        raise
-                    time.sleep(base_delay * (2 ** attempt))
-                    continue
-                
-                # Get league stats with increased timeout and retry
-                try:
-                    player_stats = leaguedashplayerstats.LeagueDashPlayerStats(
-                        season='2023-24',
-                        headers=self.headers,
-                        timeout=30,  # Reduced timeout to prevent Gunicorn worker timeout
-                        per_mode_detailed='PerGame'
-                    ).get_normalized_dict()
-                except Timeout:
-                    print(f"[DEBUG] League stats request timed out. Attempt {attempt + 1}/{max_retries}")
-                    if attempt == max_retries - 1:
-                        raise
-                    time.sleep(base_delay * (2 ** attempt))
-                    continue
+                if cached_stats:
+                    # Only the league snapshot may need fetching, under the same deadline and retries
+                    _, _, league_columns = self.get_league_stats(deadline)
+                    return cached_stats, league_columns
+
+                # Player info and league stats are independent, so fetch them concurrently
+                with ThreadPoolExecutor(max_workers=2) as executor:
+                    info_future = executor.submit(self._fetch_player_info, player_id, deadline)
+                    # League stats are cached across players
+                    league_future = executor.submit(self.get_league_stats, deadline)
+
+                    player_info = info_future.result()
+                    _, stats_by_id, league_columns = league_future.result()
                 
                 # Find player's stats in league stats
-                stats_list = player_stats['LeagueDashPlayerStats']
-                player_current_stats = next(
-                    (player for player in stats_list if player['PLAYER_ID'] == player_id),
-                    None
-                )
+                player_current_stats = stats_by_id.get(player_id)
                 
                 if not player_current_stats:
                     raise ValueError("Could not find current season stats")
@@ -159,13 +347,14 @@ class NBAStatsCard:
                 self._save_to_cache(player_name, stats)
                 
                 print("[DEBUG] Successfully retrieved player stats")
-                return stats, stats_list
+                return stats, league_columns
                 
             except Timeout:
-                wait_time = base_delay * (2 ** attempt)
-                print(f"[DEBUG] Timeout occurred. Attempt {attempt + 1}/{max_retries}. Waiting {wait_time} seconds...")
                 if attempt == max_retries - 1:
-                    raise Exception("NBA API timed out after multiple attempts. Please try again later.")
+                    raise Timeout("NBA API timed out after multiple attempts. Please try again later.")
+                # Jittered backoff so concurrent workers don't retry in lockstep
+                wait_time = min(random.uniform(0, base_delay * (2 ** attempt)), max(deadline - time.monotonic(), 0))
+                print(f"[DEBUG] Timeout occurred. Attempt {attempt + 1}/{max_retries}. Waiting {wait_time:.1f} seconds...")
                 time.sleep(wait_time)
                 continue
                 
@@ -173,51 +362,43 @@ class NBAStatsCard:
                 print(f"[ERROR] Failed to fetch stats: {str(e)}")
                 raise
 
-    def calculate_percentile(self, value, stat_list):
-        """Calculate percentile rank for a given stat."""
-        return round(sum(1 for x in stat_list if x <= value) / len(stat_list) * 100)
+    def calculate_percentile(self, value, sorted_values):
+        """Calculate percentile rank for a given stat from the league's sorted values."""
+        return int(round(np.searchsorted(sorted_values, value, side='right') / len(sorted_values) * 100))
 
-    def get_gradient_color(self, percentile):
-        """Get color based on percentile rank."""
+    def _compute_gradient_color(self, percentile):
+        """Interpolate the gradient color for a percentile rank."""
+        poor = self._gradient_rgb['gradient_poor']
+        neutral = self._gradient_rgb['gradient_neutral']
+        excellent = self._gradient_rgb['gradient_excellent']
         if percentile < 50:
             # Poor to neutral
             ratio = percentile / 50
-            r = int(int(self.colors['gradient_poor'][1:3], 16) * (1 - ratio) + 
-                   int(self.colors['gradient_neutral'][1:3], 16) * ratio)
-            g = int(int(self.colors['gradient_poor'][3:5], 16) * (1 - ratio) + 
-                   int(self.colors['gradient_neutral'][3:5], 16) * ratio)
-            b = int(int(self.colors['gradient_poor'][5:7], 16) * (1 - ratio) + 
-                   int(self.colors['gradient_neutral'][5:7], 16) * ratio)
+            start, end = poor, neutral
         else:
             # Neutral to excellent
             ratio = (percentile - 50) / 50
-            r = int(int(self.colors['gradient_neutral'][1:3], 16) * (1 - ratio) + 
-                   int(self.colors['gradient_excellent'][1:3], 16) * ratio)
-            g = int(int(self.colors['gradient_neutral'][3:5], 16) * (1 - ratio) + 
-                   int(self.colors['gradient_excellent'][3:5], 16) * ratio)
-            b = int(int(self.colors['gradient_neutral'][5:7], 16) * (1 - ratio) + 
-                   int(self.colors['gradient_excellent'][5:7], 16) * ratio)
+            start, end = neutral, excellent
+        r, g, b = (int(s * (1 - ratio) + e * ratio) for s, e in zip(start, end))
         return f'#{r:02x}{g:02x}{b:02x}'
 
+    def get_gradient_color(self, percentile):
+        """Get color based on percentile rank."""
+        return self._gradient[percentile]
+
     def create_stats_card(self, player_name):
         """Generate the stats card for a given player."""
         # Get player stats
-        stats, league_stats = self.get_player_stats(player_name)
+        stats, league_columns = self.get_player_stats(player_name)
         
         # Create image
         width, height = 800, 1000
         image = Image.new('RGB', (width, height), self.colors['background'])
         draw = ImageDraw.Draw(image)
         
-        # Load fonts (you'll need to provide your own font files)
-        try:
-            title_font = ImageFont.truetype("arial.ttf", 40)
-            header_font = ImageFont.truetype("arial.ttf", 30)
-            stats_font = ImageFont.truetype("arial.ttf", 24)
-        except:
-            title_font = ImageFont.load_default()
-            header_font = ImageFont.load_default()
-            stats_font = ImageFont.load_default()
+        title_font = self._TITLE_FONT
+        header_font = self._HEADER_FONT
+        stats_font = self._STATS_FONT
 
         # Draw player name and basic info
         draw.text((40, 40), stats['name'], fill=self.colors['text'], font=title_font)
@@ -226,19 +407,21 @@ class NBAStatsCard:
 
         # Draw basic stats
         y_pos = 180
-        basic_stats = [
-            f"Games Played: {stats['G']}",
-            f"Points: {stats['PTS']:.1f}",
-            f"Rebounds: {stats['TRB']:.1f}",
-            f"Assists: {stats['AST']:.1f}",
-            f"FG%: {stats['FG%']:.1%}",
-            f"3P%: {stats['3P%']:.1%}",
+        basic_stats = (
+            f"Games Played: {stats['G']}\n"
+            f"Points: {stats['PTS']:.1f}\n"
+            f"Rebounds: {stats['TRB']:.1f}\n"
+            f"Assists: {stats['AST']:.1f}\n"
+            f"FG%: {stats['FG%']:.1%}\n"
+            f"3P%: {stats['3P%']:.1%}\n"
             f"FT%: {stats['FT%']:.1%}"
-        ]
+        )
 
-        for stat in basic_stats:
-            draw.text((40, y_pos), stat, fill=self.colors['text'], font=stats_font)
-            y_pos += 40
+        # One multiline call for the whole block; spacing keeps lines 40px apart
+        line_height = 40
+        draw.multiline_text((40, y_pos), basic_stats, fill=self.colors['text'],
+                            font=stats_font, spacing=line_height - stats_font.getbbox("A")[3])
+        y_pos += line_height * (basic_stats.count("\n") + 1)
 
         # Draw advanced stats with percentiles
         y_pos += 40
@@ -248,14 +431,14 @@ class NBAStatsCard:
 
         # Calculate and display advanced stats percentiles
         advanced_stats = {
-            'PER': [stats['PER'], [(p['PTS'] + p['REB'] + p['AST']) / p['GP'] for p in league_stats]],
-            'TS%': [stats['TS%'] * 100, [(p['PTS'] / (2 * (p['FGA'] + 0.44 * p['FTA']))) * 100 if p['FGA'] > 0 else 0 for p in league_stats]],
-            'AST/G': [stats['AST/G'], [p['AST'] / p['GP'] for p in league_stats]],
-            'REB/G': [stats['TRB/G'], [p['REB'] / p['GP'] for p in league_stats]]
+            'PER': [stats['PER'], league_columns['PER']],
+            'TS%': [stats['TS%'] * 100, league_columns['TS%']],
+            'AST/G': [stats['AST/G'], league_columns['AST/G']],
+            'REB/G': [stats['TRB/G'], league_columns['REB/G']]
         }
 
         for stat_name, (stat_value, league_values) in advanced_stats.items():
-            if pd.notna(stat_value):  # Only display if value exists
+            if stat_value is not None and not math.isnan(stat_value):  # Only display if value exists
                 percentile = self.calculate_percentile(stat_value, league_values)
                 color = self.get_gradient_color(percentile)
                 
@@ -295,7 +478,7 @@ def main():
         print(f"Generating stats card for {player_name}...")
         card = generator.create_stats_card(player_name)
         output_file = os.path.join(cards_dir, f"{player_name.replace(' ', '_').lower()}_stats_card.png")
-        card.save(output_file)
+        card.save(output_file, **PNG_SAVE_OPTIONS)
         print(f"Stats card generated successfully! Saved as: {output_file}")
     except Exception as e:
         print(f"Error generating stats card: {str(e)}")